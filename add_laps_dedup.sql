@@ -0,0 +1,42 @@
+-- 6-Urenloop Lap Tracker: batched lap insert with server-side duplicate suppression
+--
+-- Run once in the Supabase SQL editor. lap_tracker.py calls it as
+--   supabase.rpc('add_laps_dedup', {'rows': [{"class_id": ..., "timestamp": ...}, ...]})
+--
+-- A lap is skipped when the same class already has a lap within 30 seconds of it,
+-- no matter which tracker recorded it. Rows are handled in timestamp order inside
+-- one transaction, so duplicates within a single batch are caught as well.
+-- Returns the number of laps actually inserted.
+
+create or replace function add_laps_dedup(rows jsonb)
+returns integer
+language plpgsql
+as $$
+declare
+    lap record;
+    inserted integer := 0;
+begin
+    for lap in
+        select (r->>'class_id')::uuid as class_id,
+               (r->>'timestamp')::timestamptz as ts
+        from jsonb_array_elements(rows) as r
+        order by 2
+    loop
+        -- Serialize concurrent trackers writing laps for the same class
+        perform pg_advisory_xact_lock(hashtext(lap.class_id::text));
+
+        if not exists (
+            select 1
+            from laps l
+            where l.class_id = lap.class_id
+              and l."timestamp" > lap.ts - interval '30 seconds'
+              and l."timestamp" < lap.ts + interval '30 seconds'
+        ) then
+            insert into laps (class_id, "timestamp") values (lap.class_id, lap.ts);
+            inserted := inserted + 1;
+        end if;
+    end loop;
+
+    return inserted;
+end;
+$$;
@@ -0,0 +1,34 @@
+"""
+Postgres connection pool for the 6-Urenloop Lap Tracker.
+
+Talks to the Supabase database directly with asyncpg so repeated class
+lookups reuse warm connections instead of paying a new REST round trip.
+
+Requirements:
+- pip install asyncpg
+- SUPABASE_DB_URL in the .env file (Project Settings → Database → Connection string)
+"""
+
+from typing import Optional
+
+import asyncpg
+
+
+async def create_pool(dsn: str) -> asyncpg.Pool:
+    """Create the connection pool (2-10 connections, idle ones recycled after 5 minutes)"""
+    # Supavisor in transaction mode does not support prepared statement caching
+    statement_cache_size = 0 if "pooler.supabase.com" in dsn else 100
+
+    return await asyncpg.create_pool(
+        dsn,
+        min_size=2,
+        max_size=10,
+        max_inactive_connection_lifetime=300,
+        statement_cache_size=statement_cache_size
+    )
+
+
+async def fetch_class(pool: asyncpg.Pool, class_name: str) -> Optional[tuple[str, str]]:
+    """Look up a class by name, ignoring case, and return its ID and correctly cased name"""
+    row = await pool.fetchrow("SELECT id, name FROM classes WHERE lower(name) = lower($1) LIMIT 1", class_name)
+    return (str(row["id"]), row["name"]) if row else None
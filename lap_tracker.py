@@ -5,13 +5,16 @@ A standalone Python application for tracking laps in real-time.
 
 Requirements:
 - Python 3 with tkinter support (install with: brew install python-tk)
-- Virtual environment with packages: pip install supabase pandas python-dotenv
+- Virtual environment with packages: pip install supabase python-dotenv
 
 Setup:
 1. Create virtual environment: python3 -m venv .venv
 2. Activate it: source .venv/bin/activate
-3. Install packages: pip install supabase pandas python-dotenv
+3. Install packages: pip install supabase python-dotenv
 4. Create a .env file with SUPABASE_URL and SUPABASE_KEY
+5. Run add_laps_dedup.sql once in the Supabase SQL editor
+6. Optional: pip install asyncpg and add SUPABASE_DB_URL to .env for fast pooled class lookups
+7. Optional: pip install "httpx[http2]" to upload laps over HTTP/2
 
 Usage:
 1. Activate virtual environment: source .venv/bin/activate
@@ -23,37 +26,119 @@ Usage:
 
 import tkinter as tk
 from tkinter import messagebox, font
-import pandas as pd
 import csv
+import io
 from datetime import datetime
 import os
 import sys
 from typing import Optional
 import threading
 import time
+import asyncio
+import concurrent.futures
+import collections
+import pickle
 
 # Supabase imports
 try:
     from supabase import create_client, Client
     from dotenv import load_dotenv
+    import httpx
     SUPABASE_AVAILABLE = True
 except ImportError:
     SUPABASE_AVAILABLE = False
     print("Warning: supabase or python-dotenv not installed. Only CSV logging will work.")
     print("Install with: pip install supabase python-dotenv")
 
+# HTTP/2 support for httpx (optional, pip install "httpx[http2]")
+try:
+    import h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Direct Postgres connection pool (optional)
+try:
+    import db_pool
+    ASYNCPG_AVAILABLE = True
+except ImportError:
+    ASYNCPG_AVAILABLE = False
+
+# Class mapping files
+CLASSES_FILE = "classes_rows.csv"
+BARCODE_FILE = "titularis-klassen-barcode-jaar-groep(titulars-klassen).csv"
+MAPPING_CACHE_FILE = "classes_cache.pkl"  # Parsed mappings, invalidated by the CSV mtimes
+MAPPING_CACHE_VERSION = 2  # Bump when the cached layout or key normalization changes
+
+# Lap upload batching
+LAP_BATCH_SIZE = 50  # Flush as soon as this many laps are queued
+LAP_FLUSH_INTERVAL = 2.0  # Seconds between periodic flushes
+LAP_MAX_BACKOFF = 60.0  # Upper bound for retry delay after a failed flush
+UPLOAD_STATUS_INTERVAL_MS = 2000  # Milliseconds between upload status refreshes in the UI
+
+# CSV logging
+CSV_BUFFER_SIZE = 1 << 16  # Write buffer for the persistent CSV handle
+CSV_FLUSH_INTERVAL_MS = 2000  # Milliseconds between CSV buffer flushes
+
+# Duplicate scan detection
+DUPLICATE_WINDOW = 30.0  # Seconds in which a repeat scan counts as duplicate
+RECENT_SCAN_TTL = 60.0  # Seconds before a recent scan entry is pruned
+PRUNE_INTERVAL_MS = 60_000  # Milliseconds between recent scan prunes
+
+# Lookup of unknown codes
+NEGATIVE_CACHE_SIZE = 1024  # Max remembered inputs that Supabase does not know
+
+def read_csv_columns(filename: str, columns: list[str]) -> tuple[str, list[tuple[str, ...]]]:
+    """Read selected columns from a CSV file in a single pass, detecting the encoding up front"""
+    with open(filename, 'rb') as f:
+        raw = f.read()
+    
+    # Decode the bytes once instead of re-parsing the file per encoding
+    for encoding in ['utf-8-sig', 'cp1252', 'latin-1']:
+        try:
+            text = raw.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    
+    # Plain csv.reader with precomputed column indexes avoids a dict per row
+    reader = csv.reader(io.StringIO(text, newline=''))
+    header_row = next(reader, None)
+    if header_row is None:
+        return encoding, []
+    header = [name.strip() for name in header_row]
+    indexes = [header.index(column) for column in columns]
+    rows = [tuple(row[i].strip() for i in indexes) for row in reader if row]
+    return encoding, rows
+
 class LapTracker:
     def __init__(self):
         self.root = tk.Tk()
         self.processing = False  # Prevent duplicate processing
         self.last_processed_text = ""  # Track last processed text
-        self.recent_scans = {}  # Track recent scans by class with timestamps
+        self._pending_after: Optional[str] = None  # Pending debounced auto-submit callback
+        self.classes_dict: dict[str, str] = {}  # Class name -> class ID
+        self.barcode_dict: dict[str, str] = {}  # Barcode -> class name
+        self._negative_cache: collections.OrderedDict[str, None] = collections.OrderedDict()  # Keys Supabase does not know, oldest first
+        self.recent_scans: dict[str, float] = {}  # Track recent scans by class with monotonic timestamps
+        self._lap_queue: list[dict] = []  # Laps waiting to be sent to Supabase, only touched on the asyncio loop
+        self._queue_event = asyncio.Event()  # Wakes the flush task early
+        self._flush_task: Optional[concurrent.futures.Future] = None
+        self._stop_flush = False  # Tells the flush task to exit after its current flush
+        self._upload_failing = False  # True while the flush task is backing off after a failed upload
+        self._http: Optional["httpx.AsyncClient"] = None  # Async REST client for lap uploads
+        self._loop: Optional[asyncio.AbstractEventLoop] = None  # Background asyncio loop
+        self.start_async_loop()
         self.setup_window()
         self.load_classes_mapping()
         self.setup_supabase()
+        self.setup_http_client()
+        self.setup_db_pool()
         self.setup_csv()
         self.setup_ui()
         self.setup_bindings()
+        self.start_lap_flusher()
+        self.root.after(PRUNE_INTERVAL_MS, self._prune_recent)
         
     def setup_window(self):
         """Configure the main window"""
@@ -70,20 +155,17 @@ class LapTracker:
     
     def load_classes_mapping(self):
         """Load class name to ID mapping from CSV file and barcode mapping"""
-        self.classes_dict = {}
-        self.barcode_dict = {}
-        
+        cache_key = self.mapping_cache_key()
+        if self.load_mapping_cache(cache_key):
+            return
+            
         try:
             # Load class name to ID mapping from classes_rows.csv
-            if os.path.exists("classes_rows.csv"):
-                with open("classes_rows.csv", 'r', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        class_name = row['name'].strip()
-                        class_id = row['id'].strip()
-                        self.classes_dict[class_name] = class_id
+            if os.path.exists(CLASSES_FILE):
+                _, rows = read_csv_columns(CLASSES_FILE, ['name', 'id'])
+                self.classes_dict = dict(rows)
                 
-                print(f"✅ Loaded {len(self.classes_dict)} classes from classes_rows.csv")
+                print(f"✅ Loaded {len(self.classes_dict)} classes from {CLASSES_FILE}")
                 
                 # Print first few classes for verification
                 if len(self.classes_dict) > 0:
@@ -96,23 +178,12 @@ class LapTracker:
                 print("⚠️  classes_rows.csv not found. Will use Supabase lookup instead.")
             
             # Load barcode to class mapping from titularis CSV
-            barcode_file = "titularis-klassen-barcode-jaar-groep(titulars-klassen).csv"
-            if os.path.exists(barcode_file):
-                # Try different encodings
-                for encoding in ['utf-8', 'latin-1', 'cp1252']:
-                    try:
-                        with open(barcode_file, 'r', encoding=encoding) as f:
-                            reader = csv.DictReader(f)
-                            for row in reader:
-                                barcode = row['barcode'].strip()
-                                class_name = row['Klas'].strip()
-                                self.barcode_dict[barcode] = class_name
-                        print(f"✅ Used encoding: {encoding}")
-                        break
-                    except UnicodeDecodeError:
-                        continue
+            if os.path.exists(BARCODE_FILE):
+                encoding, rows = read_csv_columns(BARCODE_FILE, ['barcode', 'Klas'])
+                self.barcode_dict = dict(rows)
+                print(f"✅ Used encoding: {encoding}")
                 
-                print(f"✅ Loaded {len(self.barcode_dict)} barcodes from {barcode_file}")
+                print(f"✅ Loaded {len(self.barcode_dict)} barcodes from {BARCODE_FILE}")
                 
                 # Print first few barcodes for verification
                 if len(self.barcode_dict) > 0:
@@ -127,10 +198,74 @@ class LapTracker:
         except Exception as e:
             print(f"❌ Error loading mappings: {e}")
             print("⚠️  Will fallback to Supabase lookup")
+            self.build_lookup_tables()
+            return
+        
+        self.build_lookup_tables()
+        self.save_mapping_cache(cache_key)
+    
+    def mapping_cache_key(self) -> tuple[int, Optional[int], Optional[int]]:
+        """Cache format version plus modification times of the mapping CSVs, used to invalidate the pickle cache"""
+        key = [MAPPING_CACHE_VERSION]
+        for filename in [CLASSES_FILE, BARCODE_FILE]:
+            try:
+                key.append(os.stat(filename).st_mtime_ns)
+            except OSError:
+                key.append(None)
+        return tuple(key)
+    
+    def load_mapping_cache(self, cache_key: tuple) -> bool:
+        """Load parsed mappings from the pickle cache if it matches the current CSVs"""
+        try:
+            with open(MAPPING_CACHE_FILE, 'rb') as f:
+                cached_key, mappings = pickle.load(f)
+            if cached_key != cache_key:
+                return False
+            classes_dict, barcode_dict, name_to_id, canonical_names, barcode_to_id, barcode_to_name = mappings
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"⚠️  Ignoring unreadable mapping cache: {e}")
+            return False
+            
+        # Only assign once the whole cache has unpacked cleanly
+        self.classes_dict, self.barcode_dict = classes_dict, barcode_dict
+        self.name_to_id, self.canonical_names = name_to_id, canonical_names
+        self.barcode_to_id, self.barcode_to_name = barcode_to_id, barcode_to_name
+        print(f"✅ Loaded {len(self.classes_dict)} classes and {len(self.barcode_dict)} barcodes from {MAPPING_CACHE_FILE}")
+        return True
+    
+    def save_mapping_cache(self, cache_key: tuple):
+        """Store parsed mappings so the next start can skip CSV parsing"""
+        if cache_key[1:] == (None, None):
+            return
+            
+        mappings = (self.classes_dict, self.barcode_dict, self.name_to_id,
+                    self.canonical_names, self.barcode_to_id, self.barcode_to_name)
+        try:
+            with open(MAPPING_CACHE_FILE, 'wb') as f:
+                pickle.dump((cache_key, mappings), f, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            print(f"⚠️  Could not write mapping cache: {e}")
+    
+    def build_lookup_tables(self):
+        """Precompute normalized lookup tables so a scan needs a single dict probe"""
+        # Keys are normalized with .strip().casefold() once here instead of on every scan
+        self.name_to_id = {name.strip().casefold(): class_id for name, class_id in self.classes_dict.items()}
+        # Correctly cased class name for typed input, so "1l4" is shown, logged and deduplicated as "1L4"
+        self.canonical_names = {name.strip().casefold(): name for name in self.classes_dict}
+        self.barcode_to_name = {barcode.strip().casefold(): name for barcode, name in self.barcode_dict.items()}
+        self.barcode_to_id = {
+            barcode: self.classes_dict[name]
+            for barcode, name in self.barcode_to_name.items()
+            if name in self.classes_dict
+        }
         
     def setup_supabase(self):
         """Initialize Supabase client and authenticate"""
         self.supabase: Optional[Client] = None
+        self._auth_email: Optional[str] = None  # Set once authenticate_user succeeds
+        self._service_role = False  # Connected with the service role key (RLS bypassed)
         
         if not SUPABASE_AVAILABLE:
             return
@@ -140,12 +275,16 @@ class LapTracker:
             load_dotenv()
             
             url = os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL")
+            self._supabase_url = url
             
             # Try service role key first (bypasses RLS)
             service_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
             if service_key:
+                self._supabase_key = self._access_token = service_key
                 self.supabase = create_client(url, service_key)
+                self._service_role = True
                 print("✅ Supabase connection established with service role key (RLS bypassed)")
+                self.prefetch_classes()
                 return
             
             # Fall back to regular key with user authentication
@@ -155,16 +294,78 @@ class LapTracker:
                 print("Warning: SUPABASE_URL or SUPABASE_KEY not found in environment variables")
                 return
                 
+            self._supabase_key = self._access_token = key
             self.supabase = create_client(url, key)
             print("✅ Supabase connection established")
             
             # Try to authenticate with user credentials
             self.authenticate_user()
+            self.prefetch_classes()
             
         except Exception as e:
             print(f"❌ Failed to connect to Supabase: {e}")
             self.supabase = None
     
+    def prefetch_classes(self):
+        """Load all classes from Supabase in one request when classes_rows.csv was not available"""
+        if self.classes_dict or not self.supabase:
+            return
+            
+        try:
+            response = self.supabase.table("classes").select("id,name").execute()
+            self.classes_dict = {row['name'].strip(): row['id'] for row in response.data}
+            self.build_lookup_tables()
+            print(f"✅ Loaded {len(self.classes_dict)} classes from Supabase")
+        except Exception as e:
+            print(f"❌ Error loading classes from Supabase: {e}")
+            print("⚠️  Will fallback to per-class Supabase lookup")
+    
+    def start_async_loop(self):
+        """Start a dedicated asyncio event loop thread so the Tk mainloop is untouched"""
+        if self._loop:
+            return
+            
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+    
+    def run_async(self, coro) -> concurrent.futures.Future:
+        """Schedule a coroutine on the background loop from a Tk callback"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+    
+    def setup_http_client(self):
+        """Create the async HTTP client used for lap uploads"""
+        if not self.supabase:
+            return
+            
+        # HTTP/2 multiplexes concurrent uploads over a single connection
+        self._http = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            base_url=self._supabase_url,
+            headers={"apikey": self._supabase_key, "Content-Type": "application/json"},
+            timeout=10.0
+        )
+        if not HTTP2_AVAILABLE:
+            print("💡 Install httpx[http2] for HTTP/2 lap uploads")
+    
+    def setup_db_pool(self):
+        """Open a pooled direct Postgres connection for class lookups"""
+        self.db_pool = None
+        
+        if not ASYNCPG_AVAILABLE:
+            return
+            
+        dsn = os.getenv("SUPABASE_DB_URL")
+        if not dsn:
+            print("💡 Add SUPABASE_DB_URL to .env file for pooled class lookups")
+            return
+            
+        try:
+            self.db_pool = self.run_async(db_pool.create_pool(dsn)).result(timeout=10)
+            print("✅ Postgres connection pool established")
+        except Exception as e:
+            print(f"❌ Failed to create Postgres connection pool: {e}")
+            self.db_pool = None
+    
     def authenticate_user(self):
         """Authenticate user with Supabase to bypass RLS"""
         if not self.supabase:
@@ -186,6 +387,10 @@ class LapTracker:
             })
             
             if auth_response.user:
+                self._auth_email = auth_response.user.email
+                self._access_token = auth_response.session.access_token
+                # Keep the upload token current when the client refreshes the session
+                self.supabase.auth.on_auth_state_change(self._on_auth_state_change)
                 print(f"✅ Authenticated as user: {auth_response.user.email}")
                 print("🔓 RLS policies should now allow database operations")
             else:
@@ -195,17 +400,51 @@ class LapTracker:
             print(f"❌ Authentication error: {e}")
             print("⚠️  Will proceed without authentication - database writes may fail due to RLS")
     
+    def _on_auth_state_change(self, event, session):
+        """Track the latest access token for the async HTTP client"""
+        if session:
+            self._access_token = session.access_token
+    
     def setup_csv(self):
         """Setup CSV logging"""
         self.csv_filename = f"laps_{datetime.now().strftime('%Y%m%d')}.csv"
         
-        # Create CSV file with headers if it doesn't exist
-        if not os.path.exists(self.csv_filename):
-            with open(self.csv_filename, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow(['timestamp', 'class_name', 'class_id', 'success', 'scan_type'])
+        # Keep one buffered handle open for the whole session instead of reopening per lap
+        self._csv_fh = open(self.csv_filename, 'a+', buffering=CSV_BUFFER_SIZE, newline='', encoding='utf-8')
+        self._csv_writer = csv.writer(self._csv_fh)
+        self._csv_pending: list[tuple] = []  # Raw lap tuples, formatted into rows at flush time
+        
+        # Write headers if the file is empty (fstat on the open handle, no separate exists check)
+        if os.fstat(self._csv_fh.fileno()).st_size == 0:
+            self._csv_writer.writerow(['timestamp', 'class_name', 'class_id', 'success', 'scan_type'])
                 
         print(f"📁 CSV logging to: {self.csv_filename}")
+        self.root.after(CSV_FLUSH_INTERVAL_MS, self._flush_csv)
+    
+    def _flush_csv(self):
+        """Periodically flush buffered CSV rows to disk"""
+        self.write_pending_csv_rows()
+        self.root.after(CSV_FLUSH_INTERVAL_MS, self._flush_csv)
+    
+    def write_pending_csv_rows(self):
+        """Format pending laps into CSV rows and write them in one batch"""
+        pending = self._csv_pending
+        self._csv_pending = []
+        
+        try:
+            self._csv_writer.writerows([
+                (
+                    datetime.fromtimestamp(timestamp).isoformat(),
+                    f"{input_text} → {display_name}" if input_text != display_name else display_name,
+                    class_id or "UNKNOWN",
+                    success,
+                    scan_type
+                )
+                for timestamp, input_text, display_name, class_id, success, scan_type in pending
+            ])
+            self._csv_fh.flush()
+        except Exception as e:
+            print(f"❌ Error writing to CSV: {e}")
     
     def setup_ui(self):
         """Create the user interface"""
@@ -263,22 +502,32 @@ class LapTracker:
         )
         self.status_label.pack(pady=20)
         
+        # Upload status, only filled in while Supabase uploads are failing
+        self.upload_label = tk.Label(
+            self.main_frame,
+            text="",
+            font=status_font,
+            fg='#ff8800',
+            bg='black'
+        )
+        self.upload_label.pack(pady=10)
+        if self._http:
+            self.root.after(UPLOAD_STATUS_INTERVAL_MS, self._update_upload_status)
+        
         # Connection status
         if self.supabase:
-            # Check if user is authenticated
-            try:
-                user = self.supabase.auth.get_user()
-                if user.user:
-                    supabase_status = f"🟢 Supabase verbonden (🔓 {user.user.email})"
-                else:
-                    supabase_status = "🟢 Supabase verbonden (⚠️ niet ingelogd)"
-            except:
-                supabase_status = "🟢 Supabase verbonden"
+            # Use the user cached by authenticate_user
+            if self._service_role:
+                supabase_status = "🟢 Supabase verbonden (🔑 service role)"
+            elif self._auth_email:
+                supabase_status = f"🟢 Supabase verbonden (🔓 {self._auth_email})"
+            else:
+                supabase_status = "🟢 Supabase verbonden (⚠️ niet ingelogd)"
         else:
             supabase_status = "🔴 Alleen CSV logging"
             
-        classes_count = len(getattr(self, 'classes_dict', {}))
-        barcodes_count = len(getattr(self, 'barcode_dict', {}))
+        classes_count = len(self.classes_dict)
+        barcodes_count = len(self.barcode_dict)
         classes_status = f"📚 {classes_count} klassen, 🏷️ {barcodes_count} barcodes geladen"
         connection_text = f"{supabase_status} | {classes_status}"
         
@@ -291,6 +540,18 @@ class LapTracker:
         )
         self.connection_label.pack(side=tk.BOTTOM, pady=20)
         
+        # Success screen, built once and reused for every lap
+        self._success_font = font.Font(family="Arial", size=72, weight="bold")
+        self.success_frame = tk.Frame(self.root, bg='#00ff00')
+        self.success_label = tk.Label(
+            self.success_frame,
+            font=self._success_font,
+            fg='black',
+            bg='#00ff00',
+            justify=tk.CENTER
+        )
+        self.success_label.pack(expand=True)
+        
     def setup_bindings(self):
         """Setup keyboard bindings"""
         self.root.bind('<Return>', self.process_lap)
@@ -313,29 +574,13 @@ class LapTracker:
         # Hide main frame
         self.main_frame.pack_forget()
         
-        # Create success frame
-        success_frame = tk.Frame(self.root, bg='#00ff00')
-        success_frame.pack(fill=tk.BOTH, expand=True)
+        # Show the prebuilt success frame with this lap's message
+        self.success_label.config(text=f"LAP TOEGEVOEGD!\n{class_name}")
+        self.success_frame.pack(fill=tk.BOTH, expand=True)
         
-        # Success message
-        success_font = font.Font(family="Arial", size=72, weight="bold")
-        success_label = tk.Label(
-            success_frame,
-            text=f"LAP TOEGEVOEGD!\n{class_name}",
-            font=success_font,
-            fg='black',
-            bg='#00ff00',
-            justify=tk.CENTER
-        )
-        success_label.pack(expand=True)
-        
-        # Update display
-        self.root.update()
-        
-        # Wait 1 second then restore main frame
+        # Restore main frame after 1 second
         def restore_main():
-            time.sleep(1)
-            success_frame.destroy()
+            self.success_frame.pack_forget()
             self.main_frame.pack(fill=tk.BOTH, expand=True)
             self.input_var.set("")  # Clear input
             self.input_entry.focus_set()  # Restore focus
@@ -345,8 +590,8 @@ class LapTracker:
             self.processing = False
             self.last_processed_text = ""
             
-        # Run in thread to not block UI
-        threading.Thread(target=restore_main, daemon=True).start()
+        # Schedule on the Tk mainloop instead of sleeping in a thread
+        self.root.after(1000, restore_main)
     
     def show_error_screen(self, input_text: str):
         """Show orange error screen for unmapped codes for 1 second"""
@@ -369,12 +614,8 @@ class LapTracker:
         )
         error_label.pack(expand=True)
         
-        # Update display
-        self.root.update()
-        
-        # Wait 1 second then restore main frame
+        # Restore main frame after 1 second
         def restore_main():
-            time.sleep(1)
             error_frame.destroy()
             self.main_frame.pack(fill=tk.BOTH, expand=True)
             self.input_var.set("")  # Clear input
@@ -385,18 +626,29 @@ class LapTracker:
             self.processing = False
             self.last_processed_text = ""
             
-        # Run in thread to not block UI
-        threading.Thread(target=restore_main, daemon=True).start()
+        # Schedule on the Tk mainloop instead of sleeping in a thread
+        self.root.after(1000, restore_main)
     
     def on_text_change(self, event=None):
         """Handle text changes in input field - auto-submit when text is entered"""
         # Delay to allow scanner to complete 10-character input
-        self.root.after(250, self.check_and_process)
+        self.schedule_check()
     
     def on_paste(self, event=None):
         """Handle paste events explicitly"""
         # Delay processing to allow paste/scanner input to complete
-        self.root.after(250, self.check_and_process)
+        self.schedule_check()
+    
+    def schedule_check(self):
+        """Debounce auto-submit so a burst of keystrokes triggers a single check"""
+        if self._pending_after:
+            self.root.after_cancel(self._pending_after)
+        self._pending_after = self.root.after(250, self._run_check)
+    
+    def _run_check(self):
+        """Run the debounced check and clear the pending handle"""
+        self._pending_after = None
+        self.check_and_process()
         
     def check_and_process(self):
         """Check if there's text and process it automatically"""
@@ -414,98 +666,169 @@ class LapTracker:
             # Only auto-process if it looks like a class name (has some content)
             self.process_lap()
     
-    def get_class_id_by_name(self, input_text: str) -> Optional[str]:
-        """Get class ID by input (barcode or class name) - try barcode mapping first, then class name mapping"""
-        input_text = input_text.strip()
-        final_class_name = input_text
-        
-        # First check if input is a barcode
-        if hasattr(self, 'barcode_dict') and input_text in self.barcode_dict:
-            final_class_name = self.barcode_dict[input_text]
-            print(f"🏷️  Barcode '{input_text}' mapped to class '{final_class_name}'")
-        
-        # Now try to find class ID for the final class name
-        if hasattr(self, 'classes_dict') and final_class_name in self.classes_dict:
-            print(f"✅ Found class '{final_class_name}' in local mapping")
-            return self.classes_dict[final_class_name]
+    def get_class_id_by_name(self, key: str, final_class_name: str) -> Optional[str]:
+        """Get class ID by normalized input key (barcode or class name), falling back to Supabase by class name"""
+        class_id = self.barcode_to_id.get(key) or self.name_to_id.get(key)
+        if class_id:
+            return class_id
+        
+        # Skip Supabase for inputs it already told us it does not know
+        if key in self._negative_cache:
+            print(f"❌ Class '{final_class_name}' not found (cached miss)")
+            return None
         
         # Fallback to Supabase if not found locally
-        if not self.supabase:
+        if not self.db_pool and not self.supabase:
             print(f"❌ Class '{final_class_name}' not found in local mapping and no Supabase connection")
             return None
             
         try:
             print(f"🔍 Class '{final_class_name}' not in local mapping, trying Supabase...")
-            response = self.supabase.table("classes").select("id").eq("name", final_class_name).execute()
+            if self.db_pool:
+                match = self.run_async(db_pool.fetch_class(self.db_pool, final_class_name)).result(timeout=5)
+            else:
+                # ilike matches case-insensitively; escape its wildcards so the name matches literally
+                pattern = final_class_name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                response = self.supabase.table("classes").select("id,name").ilike("name", pattern).limit(1).execute()
+                match = (response.data[0]["id"], response.data[0]["name"]) if response.data else None
             
-            if response.data and len(response.data) > 0:
-                class_id = response.data[0]["id"]
+            if match:
+                class_id, final_class_name = match
                 print(f"✅ Found class '{final_class_name}' in Supabase")
-                # Optionally add to local dict for future use
+                # Cache in the lookup tables for future scans
                 self.classes_dict[final_class_name] = class_id
+                self.name_to_id[final_class_name.casefold()] = class_id
+                self.canonical_names[final_class_name.casefold()] = final_class_name
+                if key in self.barcode_to_name:
+                    self.barcode_to_id[key] = class_id
                 return class_id
             else:
                 print(f"❌ Class '{final_class_name}' not found in Supabase either")
+                self._negative_cache[key] = None
+                if len(self._negative_cache) > NEGATIVE_CACHE_SIZE:
+                    self._negative_cache.popitem(last=False)
                 return None
                 
         except Exception as e:
             print(f"❌ Error fetching class ID from Supabase: {e}")
             return None
     
-    def add_lap_to_supabase(self, class_id: str) -> bool:
-        """Add a lap to Supabase database"""
-        if not self.supabase:
+    async def add_lap_to_supabase(self, class_id: str) -> bool:
+        """Queue a lap for the next batched Supabase upload (runs on the asyncio loop)"""
+        if not self._http:
             return False
             
-        try:
-            lap_data = {
-                "class_id": class_id,
-                "timestamp": datetime.now().isoformat()
-            }
+        lap_data = {
+            "class_id": class_id,
+            "timestamp": datetime.now().isoformat()
+        }
+        self._lap_queue.append(lap_data)
+        queued = len(self._lap_queue)
+        
+        # Wake the flush task early when a full batch is waiting, unless it is backing off
+        if queued >= LAP_BATCH_SIZE and not self._upload_failing:
+            self._queue_event.set()
             
-            response = self.supabase.table("laps").insert(lap_data).execute()
+        print(f"📤 Lap queued for Supabase for class_id: {class_id} ({queued} pending)")
+        return True
+    
+    async def _post_lap_batch(self, batch: list[dict]) -> bool:
+        """Send one batch of laps through the add_laps_dedup RPC"""
+        try:
+            # The RPC skips laps that another tracker already recorded within 30 seconds
+            response = await self._http.post(
+                "/rest/v1/rpc/add_laps_dedup",
+                json={"rows": batch},
+                headers={"Authorization": f"Bearer {self._access_token}"}
+            )
+            response.raise_for_status()
+            print(f"✅ {len(batch)} lap(s) sent to Supabase, {response.json()} added")
+            return True
             
-            if response.data:
-                print(f"✅ Lap added to Supabase for class_id: {class_id}")
-                return True
-            else:
-                print(f"❌ Failed to add lap to Supabase")
-                return False
-                
         except Exception as e:
-            print(f"❌ Error adding lap to Supabase: {e}")
+            print(f"❌ Error adding {len(batch)} lap(s) to Supabase: {e}")
             return False
     
-    def add_lap_to_csv(self, class_name: str, class_id: Optional[str], success: bool, is_duplicate: bool = False):
-        """Add lap entry to CSV file"""
-        try:
-            with open(self.csv_filename, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow([
-                    datetime.now().isoformat(),
-                    class_name.strip(),
-                    class_id or "UNKNOWN",
-                    success,
-                    "DUPLICATE_SCAN" if is_duplicate else "NORMAL"
-                ])
-            status = "duplicate scan" if is_duplicate else "lap"
-            print(f"📁 {status.title()} logged to CSV: {class_name}")
+    async def flush_lap_queue(self) -> bool:
+        """Send all queued laps to Supabase, one concurrent request per LAP_BATCH_SIZE laps"""
+        batch = self._lap_queue
+        self._lap_queue = []
+        
+        if not batch or not self._http:
+            return True
             
-        except Exception as e:
-            print(f"❌ Error writing to CSV: {e}")
+        chunks = [batch[i:i + LAP_BATCH_SIZE] for i in range(0, len(batch), LAP_BATCH_SIZE)]
+        results = await asyncio.gather(*(self._post_lap_batch(chunk) for chunk in chunks))
+        
+        # Put failed chunks back in front of anything queued in the meantime
+        failed = [lap for chunk, ok in zip(chunks, results) if not ok for lap in chunk]
+        self._lap_queue[:0] = failed
+        return not failed
+    
+    def start_lap_flusher(self):
+        """Start the background task that periodically flushes queued laps"""
+        if not self._http:
+            return
+            
+        self._flush_task = self.run_async(self._lap_flush_loop())
+    
+    async def _lap_flush_loop(self):
+        """Flush queued laps every LAP_FLUSH_INTERVAL seconds, backing off on failures"""
+        delay = LAP_FLUSH_INTERVAL
+        while not self._stop_flush:
+            try:
+                await asyncio.wait_for(self._queue_event.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._queue_event.clear()
+            if self._stop_flush:
+                break
+            
+            if await self.flush_lap_queue():
+                delay = LAP_FLUSH_INTERVAL
+                self._upload_failing = False
+            else:
+                delay = min(delay * 2, LAP_MAX_BACKOFF)
+                self._upload_failing = True
+                print(f"⏳ Retrying Supabase upload in {delay:.0f}s")
+    
+    def _update_upload_status(self):
+        """Show on screen when the flush task cannot reach Supabase"""
+        if self._upload_failing:
+            self.upload_label.config(text=f"⚠️ Supabase upload mislukt - {len(self._lap_queue)} lap(s) wachten, CSV logging loopt door")
+        else:
+            self.upload_label.config(text="")
+        self.root.after(UPLOAD_STATUS_INTERVAL_MS, self._update_upload_status)
+    
+    def add_lap_to_csv(self, input_text: str, display_name: str, class_id: Optional[str], success: bool, is_duplicate: bool = False):
+        """Queue a lap entry for the next CSV flush (success means the lap was queued for Supabase)"""
+        scan_type = "DUPLICATE_SCAN" if is_duplicate else "NORMAL"
+        self._csv_pending.append((time.time(), input_text, display_name, class_id, success, scan_type))
+        status = "duplicate scan" if is_duplicate else "lap"
+        print(f"📁 {status.title()} queued for CSV: {display_name}")
+    
+    def log_unsent_laps(self):
+        """Add an UPLOAD_FAILED row to the CSV for every lap that never reached Supabase"""
+        class_names = {class_id: name for name, class_id in self.classes_dict.items()}
+        for lap in self._lap_queue:
+            class_name = class_names.get(lap["class_id"], lap["class_id"])
+            timestamp = datetime.fromisoformat(lap["timestamp"]).timestamp()
+            self._csv_pending.append((timestamp, class_name, class_name, lap["class_id"], False, "UPLOAD_FAILED"))
+        print(f"⚠️  {len(self._lap_queue)} lap(s) could not be sent to Supabase, logged as UPLOAD_FAILED in CSV")
     
     def is_recent_scan(self, class_name: str) -> bool:
         """Check if this class was scanned within the last 30 seconds"""
-        now = datetime.now()
-        if class_name in self.recent_scans:
-            last_scan_time = self.recent_scans[class_name]
-            time_diff = (now - last_scan_time).total_seconds()
-            return time_diff < 30  # Less than 30 seconds
-        return False
+        return time.monotonic() - self.recent_scans.get(class_name, -1e9) < DUPLICATE_WINDOW
     
     def update_recent_scan(self, class_name: str):
         """Update the timestamp for this class's most recent scan"""
-        self.recent_scans[class_name] = datetime.now()
+        self.recent_scans[class_name] = time.monotonic()
+    
+    def _prune_recent(self):
+        """Drop stale recent scan entries so the dict stays bounded during the race"""
+        cutoff = time.monotonic() - RECENT_SCAN_TTL
+        self.recent_scans = {name: ts for name, ts in self.recent_scans.items() if ts >= cutoff}
+        self.root.after(PRUNE_INTERVAL_MS, self._prune_recent)
     
     def process_lap(self, event=None):
         """Process a lap entry"""
@@ -525,46 +848,66 @@ class LapTracker:
         self.processing = True
         self.last_processed_text = input_text
         self.status_label.config(text="Verwerken...")
-        self.root.update()
         
-        # Resolve barcode to class name if needed
-        display_name = input_text
-        if hasattr(self, 'barcode_dict') and input_text in self.barcode_dict:
-            display_name = self.barcode_dict[input_text]
+        # Normalize once and resolve barcode or typed name to the correctly cased class name
+        key = input_text.casefold()
+        display_name = self.barcode_to_name.get(key) or self.canonical_names.get(key, input_text)
+        
+        # Get class ID (a Supabase fallback hit also records the correctly cased name)
+        class_id = self.get_class_id_by_name(key, display_name)
+        display_name = self.canonical_names.get(display_name.casefold(), display_name)
+        success = False
         
         # Check if this is a recent scan (within 1 minute)
         is_duplicate = self.is_recent_scan(display_name)
         
-        # Get class ID
-        class_id = self.get_class_id_by_name(input_text)
-        success = False
-        
         # Handle different scenarios
         if not class_id:
             # Code not found - show orange error screen
             print(f"❌ Input '{input_text}' (class: '{display_name}') not found")
-            csv_name = f"{input_text} → {display_name}" if input_text != display_name else display_name
-            self.add_lap_to_csv(csv_name, class_id, success, is_duplicate)
+            self.add_lap_to_csv(input_text, display_name, class_id, success, is_duplicate)
             self.show_error_screen(input_text)
         elif is_duplicate:
             # Duplicate scan - log to CSV and show success with duplicate message
             print(f"⏰ Duplicate scan for '{display_name}' within 1 minute - skipping Supabase, logging to CSV only")
-            csv_name = f"{input_text} → {display_name}" if input_text != display_name else display_name
-            self.add_lap_to_csv(csv_name, class_id, success, is_duplicate)
+            self.add_lap_to_csv(input_text, display_name, class_id, success, is_duplicate)
             self.show_success_screen(f"{display_name}\n(Duplicate - niet geteld)")
         else:
-            # Valid scan - add to Supabase and show success
-            success = self.add_lap_to_supabase(class_id)
+            # Valid scan - queue for Supabase in the background and show success right away
             self.update_recent_scan(display_name)  # Update timestamp for successful scans
             print(f"✅ Lap processed for '{display_name}'")
-            csv_name = f"{input_text} → {display_name}" if input_text != display_name else display_name
-            self.add_lap_to_csv(csv_name, class_id, success, is_duplicate)
+            success = self._http is not None
+            if success:
+                self.run_async(self.add_lap_to_supabase(class_id))
+            self.add_lap_to_csv(input_text, display_name, class_id, success, is_duplicate)
             self.show_success_screen(display_name)
     
     def quit_app(self, event=None):
         """Quit the application"""
         self.root.quit()
         self.root.destroy()
+        
+        # Stop the flush task and send whatever is still queued
+        if self._http:
+            try:
+                self._stop_flush = True
+                self._loop.call_soon_threadsafe(self._queue_event.set)
+                self._flush_task.result(timeout=15)
+                self.run_async(self.flush_lap_queue()).result(timeout=15)
+                self.run_async(self._http.aclose()).result(timeout=5)
+            except Exception as e:
+                print(f"❌ Error sending remaining laps to Supabase: {e}")
+            if self._lap_queue:
+                self.log_unsent_laps()
+        
+        self.write_pending_csv_rows()
+        self._csv_fh.close()
+        
+        if self.db_pool:
+            try:
+                self.run_async(self.db_pool.close()).result(timeout=5)
+            except Exception as e:
+                print(f"❌ Error closing Postgres connection pool: {e}")
         sys.exit(0)
     
     def run(self):